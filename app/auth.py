@@ -1,10 +1,7 @@
-from fastapi import FastAPI, Request, Depends, HTTPException, status
-from fastapi.responses import Response, RedirectResponse
+from fastapi import Depends, HTTPException, status
 from fastapi.security import HTTPBasic, HTTPBasicCredentials
 import base64
-import secrets
-
-app = FastAPI()
+import hmac
 
 # ======================================
 # ✅ 共通の認証情報（本番では環境変数）
@@ -12,68 +9,62 @@ app = FastAPI()
 USERNAME = "admin"
 PASSWORD = "secret123"
 
+# 期待するAuthorizationヘッダ値を起動時に1回だけ計算しておく
+# （リクエスト毎のbase64デコード＋splitを省き、比較もタイミング攻撃耐性のある1回で済む）
+_EXPECTED = b"Basic " + base64.b64encode(f"{USERNAME}:{PASSWORD}".encode())
+
 security = HTTPBasic()
 
 # ======================================
-# ✅ ミドルウェア — 全体にBasic認証を適用
+# ✅ 純ASGIミドルウェア — 全体にBasic認証を適用
+#    （BaseHTTPMiddleware経由だとリクエスト毎に
+#      Request/Responseオブジェクト生成コストがかかるため）
 # ======================================
-@app.middleware("http")
-async def basic_auth_middleware(request: Request, call_next):
-    auth = request.headers.get("authorization")
-    if not auth or not auth.startswith("Basic "):
-        return Response(
-            status_code=status.HTTP_401_UNAUTHORIZED,
-            headers={"WWW-Authenticate": 'Basic realm="Access to the site"'},
-        )
+_WWW_AUTHENTICATE = (b"www-authenticate", b'Basic realm="Access to the site"')
 
-    encoded = auth.split(" ")[1]
-    try:
-        decoded = base64.b64decode(encoded).decode("utf-8")
-        username, password = decoded.split(":", 1)
-    except Exception:
-        return Response(
-            status_code=status.HTTP_401_UNAUTHORIZED,
-            headers={"WWW-Authenticate": 'Basic realm="Access to the site"'},
-        )
 
-    if username != USERNAME or password != PASSWORD:
-        return Response(
-            status_code=status.HTTP_401_UNAUTHORIZED,
-            headers={"WWW-Authenticate": 'Basic realm="Access to the site"'},
-        )
+async def _send_401(send):
+    await send({
+        "type": "http.response.start",
+        "status": status.HTTP_401_UNAUTHORIZED,
+        "headers": [_WWW_AUTHENTICATE],
+    })
+    await send({"type": "http.response.body", "body": b""})
+
+
+class BasicAuthMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
 
-    return await call_next(request)
+        auth = None
+        for name, value in scope["headers"]:
+            if name == b"authorization":
+                auth = value
+                break
+
+        if not auth or not hmac.compare_digest(auth, _EXPECTED):
+            await _send_401(send)
+            return
+
+        await self.app(scope, receive, send)
 
 
 # ======================================
 # ✅ Depends用（個別エンドポイント用にも使える）
 # ======================================
 def basic_auth(credentials: HTTPBasicCredentials = Depends(security)):
-    correct_username = secrets.compare_digest(credentials.username, USERNAME)
-    correct_password = secrets.compare_digest(credentials.password, PASSWORD)
-    if not (correct_username and correct_password):
+    token = b"Basic " + base64.b64encode(
+        f"{credentials.username}:{credentials.password}".encode()
+    )
+    if not hmac.compare_digest(token, _EXPECTED):
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Invalid authentication credentials",
             headers={"WWW-Authenticate": "Basic"},
         )
     return credentials.username
-
-
-# ======================================
-# ✅ 認証後リダイレクト用のトップページ
-# ======================================
-@app.get("/")
-def root(request: Request, username: str = Depends(basic_auth)):
-    redirect_url = request.query_params.get("redirect")
-    if redirect_url:
-        return RedirectResponse(url=redirect_url)
-    return {"message": "認証OK"}
-
-
-# ======================================
-# ✅ 例：個別のAPIでもDependsを使える
-# ======================================
-@app.get("/secure", dependencies=[Depends(basic_auth)])
-def secure_endpoint():
-    return {"message": "You are authenticated!"}
@@ -1,21 +1,36 @@
 # app/db.py
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker, declarative_base
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+from sqlalchemy.orm import declarative_base
 import os
+import orjson
 from dotenv import load_dotenv
 
 load_dotenv()
 
 DATABASE_URL = os.getenv("DATABASE_URL")
 
-engine = create_engine(DATABASE_URL)
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+# 同期ドライバ用のURLが設定されていてもasyncpgドライバに読み替える
+if DATABASE_URL and DATABASE_URL.startswith("postgresql://"):
+    DATABASE_URL = DATABASE_URL.replace("postgresql://", "postgresql+asyncpg://", 1)
+
+engine = create_async_engine(
+    DATABASE_URL,
+    pool_pre_ping=True,
+    pool_size=20,
+    max_overflow=0,
+    pool_recycle=1800,
+    # JSONBの直列化・復元も stdlib json ではなく orjson で行う
+    json_serializer=lambda obj: orjson.dumps(obj).decode(),
+    json_deserializer=orjson.loads,
+    # フィルタ形状ごとのprepared statementを接続側で広めにキャッシュし、
+    # 同じSQLの再パース・再プランをサーバに繰り返させない
+    connect_args={"prepared_statement_cache_size": 500},
+)
+# commit後のexpireを止め、属性アクセスのたびの再SELECTを防ぐ
+SessionLocal = async_sessionmaker(engine, autoflush=False, expire_on_commit=False)
 Base = declarative_base()
 
 # 依存関数としてFastAPIで利用
-def get_db():
-    db = SessionLocal()
-    try:
+async def get_db():
+    async with SessionLocal() as db:
         yield db
-    finally:
-        db.close()
@@ -1,15 +1,29 @@
 # app/init_db.py
-from app.db import get_connection
-from app.models import CREATE_TABLES_SQL
+import os
+
+from dotenv import load_dotenv
+from sqlalchemy import create_engine, text
+
+from app.db import Base
+from app import models  # noqa: F401  # テーブル定義の読み込み
+
+# ILIKE '%...%' 検索をトライグラムインデックスで受けるための対象列
+TRGM_COLUMNS = ["部署", "社員名", "勘定科目", "備考"]
+
 
 def init():
-    conn = get_connection()
-    cur = conn.cursor()
-    cur.execute(CREATE_TABLES_SQL)
-    conn.commit()
-    cur.close()
-    conn.close()
+    load_dotenv()
+    engine = create_engine(os.getenv("DATABASE_URL"))
+    with engine.begin() as conn:
+        conn.execute(text("CREATE EXTENSION IF NOT EXISTS pg_trgm"))
+        Base.metadata.create_all(conn)
+        for i, col in enumerate(TRGM_COLUMNS, start=1):
+            conn.execute(text(
+                f"CREATE INDEX IF NOT EXISTS idx_expense_rows_trgm_{i} "
+                f"ON expense_rows USING gin ((row_data->>'{col}') gin_trgm_ops)"
+            ))
     print("✅ Tables created (if not exists).")
 
+
 if __name__ == "__main__":
     init()
@@ -1,14 +1,28 @@
 # app/logger.py
 import logging
 import os
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+from queue import Queue
 
 LOG_DIR = "logs"
 os.makedirs(LOG_DIR, exist_ok=True)
 
-logging.basicConfig(
-    filename=os.path.join(LOG_DIR, "app.log"),
-    level=logging.INFO,
-    format="%(asctime)s [%(levelname)s] %(message)s",
+# ファイル書き込みはバックグラウンドスレッドに任せ、
+# リクエスト側の logger.info(...) はキュー投入だけで即座に戻る
+_queue = Queue(-1)
+_file_handler = RotatingFileHandler(
+    os.path.join(LOG_DIR, "app.log"),
+    maxBytes=10_000_000,
+    backupCount=5,
+    encoding="utf-8",
 )
+_file_handler.setFormatter(
+    logging.Formatter("%(asctime)s [%(levelname)s] %(message)s")
+)
+
+listener = QueueListener(_queue, _file_handler)
+listener.start()
 
 logger = logging.getLogger("app_logger")
+logger.setLevel(logging.INFO)
+logger.addHandler(QueueHandler(_queue))
@@ -1,8 +1,8 @@
 # app/models.py
 from sqlalchemy import (
-    Column, Integer, Text, TIMESTAMP, ForeignKey, func, Index
+    Column, Computed, Integer, Numeric, Text, TIMESTAMP, ForeignKey, func, Index
 )
-from sqlalchemy.dialects.postgresql import JSONB
+from sqlalchemy.dialects.postgresql import JSONB, TSVECTOR
 from sqlalchemy.orm import relationship
 from .db import Base
 
@@ -34,9 +34,39 @@ class ExpenseRow(Base):
     dataset_id = Column(Integer, ForeignKey("expense_datasets.id", ondelete="CASCADE"), nullable=False)
     row_data = Column(JSONB, nullable=False)
 
+    # 頻出フィルタ（金額・日付）はJSONBから生成列として持ち、btreeで範囲検索できるようにする。
+    # 金額は数値として解釈できない値をNULLに落とし、日付はISO文字列のまま辞書順で比較する。
+    amount = Column(
+        Numeric,
+        Computed(
+            "CASE WHEN row_data->>'金額' ~ '^-?[0-9]+(\\.[0-9]+)?$' "
+            "THEN (row_data->>'金額')::numeric END",
+            persisted=True,
+        ),
+    )
+    expense_date = Column(Text, Computed("row_data->>'日付'", persisted=True))
+
+    # フリーテキスト検索用：行全体を対象にしたtsvector（GIN転置インデックスで照合）
+    body_search = Column(
+        TSVECTOR,
+        Computed("to_tsvector('simple', row_data::text)", persisted=True),
+    )
+
     dataset = relationship("ExpenseDataset", back_populates="rows")
 
     __table_args__ = (
-        Index("idx_expense_rows_dataset", "dataset_id"),
-        Index("idx_expense_rows_rowdata", "row_data", postgresql_using="gin"),
+        # ページング（WHERE dataset_id=.. ORDER BY id LIMIT ..）を
+        # 1本のインデックスレンジスキャンで処理できる複合インデックス
+        Index("idx_expense_rows_dataset_id_id", "dataset_id", "id"),
+        # `@>` 包含検索専用。jsonb_path_opsはデフォルトのjsonb_opsより
+        # インデックスが小さく、包含判定も速い
+        Index(
+            "idx_expense_rows_rowdata",
+            "row_data",
+            postgresql_using="gin",
+            postgresql_ops={"row_data": "jsonb_path_ops"},
+        ),
+        Index("idx_expense_rows_amount", "amount"),
+        Index("idx_expense_rows_expense_date", "expense_date"),
+        Index("idx_expense_rows_body_search", "body_search", postgresql_using="gin"),
     )
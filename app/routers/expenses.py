@@ -1,15 +1,19 @@
 from fastapi import APIRouter, Depends, HTTPException, UploadFile, File, Form, Query
-from fastapi.responses import StreamingResponse
-from sqlalchemy.orm import Session
-from sqlalchemy import select, func
+from fastapi.responses import ORJSONResponse, StreamingResponse
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import select, func, insert, or_, text
 from datetime import datetime
-from typing import Optional
+from operator import itemgetter
+from typing import List, Optional
 import csv
 import io
 import os
 import time
 import re
 
+import aiofiles
+import orjson
+
 from app.db import get_db
 from app.models import ExpenseDataset, ExpenseRow
 from app.auth import basic_auth  # 🔐 Basic認証
@@ -24,12 +28,98 @@ router = APIRouter(tags=["expenses"])
 
 MAX_SIZE = 10 * 1024 * 1024  # 10MB上限
 
-def ensure_uploads_dir():
-    os.makedirs("uploads", exist_ok=True)
-    return "uploads"
+# アップロード先はモジュール読み込み時に1回だけ作成する
+UPLOADS_DIR = "uploads"
+os.makedirs(UPLOADS_DIR, exist_ok=True)
+
+# 正規表現もモジュール読み込み時に1回だけコンパイルしておく
+_PERIOD_RE = re.compile(r"^\d{4}-(0[1-9]|1[0-2])$")
+_SANITIZE_RE = re.compile(r'[\\/*?:"<>|]+')
+
+# これ以上の行数はJSON配列1パラメータで渡し、行への展開をPostgres側で行う
+BULK_INSERT_THRESHOLD = 5000
+_BULK_INSERT_SQL = text(
+    "INSERT INTO expense_rows (dataset_id, row_data) "
+    "SELECT :dataset_id, jsonb_array_elements(CAST(:payload AS jsonb))"
+)
 
 def sanitize_filename(name: str) -> str:
-    return re.sub(r'[\\/*?:"<>|]+', "_", name)
+    return _SANITIZE_RE.sub("_", name)
+
+# JSONBキーとしてあり得る列名の上限（CSVヘッダ由来なので常識的な長さに収まる）
+_FILTER_COL_MAX_LEN = 64
+
+def validate_filter_col(filter_col: Optional[str]) -> Optional[str]:
+    """フィルタ列名をリクエスト受付時点で検証する"""
+    if filter_col is None:
+        return None
+    filter_col = filter_col.strip()
+    if not filter_col or len(filter_col) > _FILTER_COL_MAX_LEN:
+        raise HTTPException(status_code=400, detail="filter_colの指定が不正です。")
+    return filter_col
+
+def row_filter_condition(filter_col: str, filter_val: str):
+    """filter_col / filter_val からrow_dataのWHERE条件を組み立てる
+
+    filter_valはカンマ区切りで複数指定でき、前後空白を落として
+    重複を除いたうえでORで束ねる（空だけならNone＝フィルタなし）。
+    ワイルドカード（% または *）を含まない値は `@>` 包含で完全一致
+    検索し、jsonb_path_opsのGINインデックスに乗せる。含む値は * を
+    % に読み替えたうえでILIKEのパターン検索にフォールバックする
+    （トライグラムインデックス対象）。
+    """
+    vals = list(dict.fromkeys(v.strip() for v in filter_val.split(",") if v.strip()))
+    if not vals:
+        return None
+    conds = []
+    for v in vals:
+        if "%" in v or "*" in v:
+            conds.append(ExpenseRow.row_data[filter_col].astext.ilike(v.replace("*", "%")))
+        else:
+            conds.append(ExpenseRow.row_data.contains({filter_col: v}))
+    # `@>` のORはGINインデックスのビットマップORで1回の走査群に収まる
+    return conds[0] if len(conds) == 1 else or_(*conds)
+
+def apply_cross_filters(
+    stmt,
+    target_branch: Optional[str],
+    period: Optional[str],
+    filter_col: Optional[str],
+    filter_val: Optional[str],
+    q: Optional[str],
+    min_amount: Optional[float],
+    max_amount: Optional[float],
+    date_from: Optional[str],
+    date_to: Optional[str],
+):
+    """横断系エンドポイント（③④）共通のフィルタをまとめて適用する
+
+    同じフィルタ形状からは毎回同じ文が組み上がるため、SQL文字列の
+    生成・コンパイルはSQLAlchemyのコンパイル済みキャッシュに乗る。
+    """
+    if target_branch:
+        stmt = stmt.where(ExpenseDataset.branch_name == target_branch)
+    if period:
+        stmt = stmt.where(ExpenseDataset.period == period)
+    if filter_col and filter_val:
+        cond = row_filter_condition(filter_col, filter_val)
+        if cond is not None:
+            stmt = stmt.where(cond)
+    # 金額・日付は生成列（btreeインデックス付き）で範囲検索する
+    if min_amount is not None:
+        stmt = stmt.where(ExpenseRow.amount >= min_amount)
+    if max_amount is not None:
+        stmt = stmt.where(ExpenseRow.amount <= max_amount)
+    if date_from:
+        stmt = stmt.where(ExpenseRow.expense_date >= date_from)
+    if date_to:
+        stmt = stmt.where(ExpenseRow.expense_date <= date_to)
+    if q:
+        # tsvector生成列に対するGIN転置インデックス検索
+        stmt = stmt.where(
+            ExpenseRow.body_search.op("@@")(func.websearch_to_tsquery("simple", q))
+        )
+    return stmt
 
 def timestamp_prefix() -> str:
     return time.strftime("%Y%m%d_%H%M%S")
@@ -54,65 +144,67 @@ def validate_file_size(file: UploadFile):
             detail="ファイルサイズが10MBを超えています"
         )
 
-def read_csv(file: UploadFile):
-    """CSV内容の検証"""
-    validate_file_extension(file)
-    validate_file_size(file)
+def read_csv(stream):
+    """CSV内容の検証＋行dictの生成（1パスのジェネレータ）
 
+    ヘッダ検証・列数検証・dict化を同じループで行い、
+    行は呼び出し側が必要なだけ取り出す。
+    """
+    wrapper = io.TextIOWrapper(stream, encoding="utf-8-sig", newline="")
     try:
-        content = file.file.read().decode("utf-8-sig")
-    except Exception:
-        raise HTTPException(status_code=400, detail="ファイルをUTF-8として読み込めません。")
-
-    reader = csv.reader(io.StringIO(content))
-    rows = list(reader)
-    if not rows:
-        raise HTTPException(status_code=400, detail="CSVが空です。")
-
-    header = rows[0]
-    if len(set(header)) != len(header):
-        raise HTTPException(status_code=400, detail="ヘッダに重複があります。")
+        try:
+            reader = csv.reader(wrapper)
+            header = next(reader, None)
+            if header is None:
+                raise HTTPException(status_code=400, detail="CSVが空です。")
 
-    data_rows = rows[1:]
-    for i, r in enumerate(data_rows, start=2):
-        if len(r) != len(header):
-            raise HTTPException(status_code=400, detail=f"{i}行目の列数が一致しません。")
+            if len(set(header)) != len(header):
+                raise HTTPException(status_code=400, detail="ヘッダに重複があります。")
 
-    return header, [dict(zip(header, row)) for row in data_rows]
+            for i, r in enumerate(reader, start=2):
+                if len(r) != len(header):
+                    raise HTTPException(status_code=400, detail=f"{i}行目の列数が一致しません。")
+                yield dict(zip(header, r))
+        except UnicodeDecodeError:
+            raise HTTPException(status_code=400, detail="ファイルをUTF-8として読み込めません。")
+    finally:
+        wrapper.detach()
 
 
 # =====================================================
 # ① CSVアップロード
 # =====================================================
 @router.post("/", status_code=201)
-def upload_expense(
+async def upload_expense(
     file: UploadFile = File(...),
     branch_name: str = Form(..., description="支店名（例：大阪支店）"),
     period: str = Form(..., description="提出月（YYYY-MM形式 例：2025-10）"),
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
     user: str = Depends(basic_auth),
 ):
     # 📅 期間フォーマットチェック
-    if not re.match(r"^\d{4}-(0[1-9]|1[0-2])$", period):
+    if not _PERIOD_RE.match(period):
         raise HTTPException(
             status_code=400,
             detail="periodはYYYY-MM形式で指定してください。"
         )
 
     # 📄 CSVチェック（拡張子・サイズ・構造）
-    header, rows = read_csv(file)
+    validate_file_extension(file)
+    validate_file_size(file)
+
+    # 元のバイト列を1回だけ読み、検証と保存の両方に使い回す
+    raw = await file.read()
+    rows = list(read_csv(io.BytesIO(raw)))
 
-    # 🗂️ 保存処理
-    uploads_dir = ensure_uploads_dir()
+    # 🗂️ 保存処理（パース済みの行からCSVを再構築せず、原本をそのまま書き出す）
     safe_name = sanitize_filename(file.filename)
     save_name = f"{timestamp_prefix()}_{safe_name}"
-    save_path = os.path.join(uploads_dir, save_name)
+    save_path = os.path.join(UPLOADS_DIR, save_name)
 
-    with open(save_path, "w", encoding="utf-8-sig", newline="") as f:
-        writer = csv.writer(f)
-        writer.writerow(header)
-        for r in rows:
-            writer.writerow(r.values())
+    # ディスク書き込みでイベントループを塞がない
+    async with aiofiles.open(save_path, "wb") as f:
+        await f.write(raw)
 
     # 📝 DB登録
     dataset = ExpenseDataset(
@@ -123,10 +215,18 @@ def upload_expense(
         period=period,
     )
     db.add(dataset)
-    db.flush()
-    db.bulk_save_objects([ExpenseRow(dataset_id=dataset.id, row_data=r) for r in rows])
-    db.commit()
-    db.refresh(dataset)
+    await db.flush()
+    if len(rows) >= BULK_INSERT_THRESHOLD:
+        await db.execute(
+            _BULK_INSERT_SQL,
+            {"dataset_id": dataset.id, "payload": orjson.dumps(rows).decode()},
+        )
+    else:
+        await db.execute(
+            insert(ExpenseRow),
+            [{"dataset_id": dataset.id, "row_data": r} for r in rows],
+        )
+    await db.commit()
 
     logger.info(f"[UPLOAD SUCCESS] user={user}, file={safe_name}, branch={branch_name}, period={period}, rows={len(rows)}")
 
@@ -146,10 +246,11 @@ def upload_expense(
 # ② アップロード履歴一覧
 # =====================================================
 @router.get("/")
-def list_datasets(
+@router.get("", include_in_schema=False)  # 末尾スラッシュなしも同じハンドラで受ける
+async def list_datasets(
     branch: Optional[str] = Query(None),
     period: Optional[str] = Query(None),
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
     user: str = Depends(basic_auth),
 ):
     stmt = select(ExpenseDataset).order_by(ExpenseDataset.uploaded_at.desc())
@@ -158,7 +259,7 @@ def list_datasets(
     if period:
         stmt = stmt.where(ExpenseDataset.period == period)
 
-    datasets = db.execute(stmt).scalars().all()
+    datasets = (await db.execute(stmt)).scalars().all()
     return {
         "data": [
             {
@@ -174,87 +275,127 @@ def list_datasets(
     }
 
 
-@router.get("", include_in_schema=False)
-def list_datasets_no_trailing_slash(
-    branch: Optional[str] = Query(None),
-    period: Optional[str] = Query(None),
-    db: Session = Depends(get_db)
-):
-    return list_datasets(branch=branch, period=period, db=db)
-
-
 # =====================================================
 # ③ 横断JSONプレビュー
 # =====================================================
 @router.get("/download_all_json")
-def download_all_json(
+async def download_all_json(
     branch_name: Optional[str] = Query(None),
     branch: Optional[str] = Query(None, alias="branch"),
     period: Optional[str] = Query(None),
     filter_col: Optional[str] = Query(None),
     filter_val: Optional[str] = Query(None),
+    q: Optional[str] = Query(None, description="フリーテキスト検索"),
+    min_amount: Optional[float] = Query(None),
+    max_amount: Optional[float] = Query(None),
+    date_from: Optional[str] = Query(None, description="YYYY-MM-DD"),
+    date_to: Optional[str] = Query(None, description="YYYY-MM-DD"),
     page: int = Query(1, ge=1),
     size: int = Query(50, ge=1, le=1000),
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
     user: str = Depends(basic_auth),
 ):
     target_branch = branch_name or branch
-    stmt = select(ExpenseRow.row_data).join(ExpenseDataset, ExpenseRow.dataset_id == ExpenseDataset.id)
-
-    if target_branch:
-        stmt = stmt.where(ExpenseDataset.branch_name == target_branch)
-    if period:
-        stmt = stmt.where(ExpenseDataset.period == period)
-    if filter_col and filter_val:
-        stmt = stmt.where(ExpenseRow.row_data[filter_col].astext.ilike(f"%{filter_val}%"))
+    filter_col = validate_filter_col(filter_col)
+    # COUNT(*)の別クエリを撃たず、ウィンドウ関数で件数を同時に取得する
+    stmt = select(
+        ExpenseRow.row_data, func.count().over().label("_total")
+    ).join(ExpenseDataset, ExpenseRow.dataset_id == ExpenseDataset.id)
+
+    stmt = apply_cross_filters(
+        stmt, target_branch, period, filter_col, filter_val,
+        q, min_amount, max_amount, date_from, date_to,
+    )
 
-    total = db.scalar(select(func.count()).select_from(stmt.subquery()))
     offset = (page - 1) * size
-    rows = db.execute(stmt.offset(offset).limit(size)).all()
+    rows = (await db.execute(stmt.offset(offset).limit(size))).all()
+    total = rows[0][1] if rows else 0
 
-    return {"meta": {"total": total, "page": page, "size": size}, "data": [r[0] for r in rows]}
+    # Responseを直接返してjsonable_encoderの全行走査をスキップする
+    # （row_dataは素のdict/strのみなのでorjsonがそのまま直列化できる）
+    return ORJSONResponse(
+        {"meta": {"total": total, "page": page, "size": size}, "data": [r[0] for r in rows]}
+    )
 
 
 # =====================================================
 # ④ 横断CSVダウンロード
 # =====================================================
 @router.get("/download_all_csv")
-def download_all_csv(
+async def download_all_csv(
     branch_name: Optional[str] = Query(None),
     branch: Optional[str] = Query(None, alias="branch"),
     period: Optional[str] = Query(None),
     filter_col: Optional[str] = Query(None),
     filter_val: Optional[str] = Query(None),
-    db: Session = Depends(get_db),
+    q: Optional[str] = Query(None, description="フリーテキスト検索"),
+    min_amount: Optional[float] = Query(None),
+    max_amount: Optional[float] = Query(None),
+    date_from: Optional[str] = Query(None, description="YYYY-MM-DD"),
+    date_to: Optional[str] = Query(None, description="YYYY-MM-DD"),
+    columns: Optional[List[str]] = Query(None, description="出力する列名（省略時は全列）"),
+    db: AsyncSession = Depends(get_db),
     user: str = Depends(basic_auth),
 ):
     target_branch = branch_name or branch
-    stmt = select(ExpenseRow.row_data).join(ExpenseDataset, ExpenseRow.dataset_id == ExpenseDataset.id)
-
-    if target_branch:
-        stmt = stmt.where(ExpenseDataset.branch_name == target_branch)
-    if period:
-        stmt = stmt.where(ExpenseDataset.period == period)
-    if filter_col and filter_val:
-        stmt = stmt.where(ExpenseRow.row_data[filter_col].astext.ilike(f"%{filter_val}%"))
+    filter_col = validate_filter_col(filter_col)
+    if columns:
+        # 必要な列だけDB側で射出し、転送量と行dictの構築コストを列数に比例して削る
+        stmt = select(
+            *[ExpenseRow.row_data[c].astext for c in columns]
+        ).join(ExpenseDataset, ExpenseRow.dataset_id == ExpenseDataset.id)
+    else:
+        stmt = select(ExpenseRow.row_data).join(ExpenseDataset, ExpenseRow.dataset_id == ExpenseDataset.id)
+
+    stmt = apply_cross_filters(
+        stmt, target_branch, period, filter_col, filter_val,
+        q, min_amount, max_amount, date_from, date_to,
+    )
 
-    def generate():
-        rows = db.execute(stmt).all()
-        if not rows:
-            yield ""
-            return
-        header = list(rows[0][0].keys())
+    async def generate():
+        # 結果を全件メモリに載せず、1000行単位でストリーミング取得する
+        result = await db.stream(stmt.execution_options(yield_per=1000))
         sio = io.StringIO()
+        # Excelで文字化けしないよう、先頭チャンクにBOMを付ける
+        # （アップロード側の保存もutf-8-sigなので対称になる）
+        sio.write("\ufeff")
         writer = csv.writer(sio, lineterminator="\n")
-        writer.writerow(header)
-        for r in rows:
-            writer.writerow([r[0].get(h, "") for h in header])
-        yield sio.getvalue()
+        if columns:
+            # 射出モード：行は値タプルで届くのでそのまま書き出す
+            writer.writerow(columns)
+            yield sio.getvalue().encode("utf-8")
+            sio.seek(0)
+            sio.truncate(0)
+            async for row in result:
+                writer.writerow(row)
+                yield sio.getvalue().encode("utf-8")
+                sio.seek(0)
+                sio.truncate(0)
+            return
+        header = None
+        get = None
+        async for (row,) in result:
+            if header is None:
+                header = list(row.keys())
+                # セル毎のdict.getの代わりにC実装のitemgetterで一括取得する
+                if len(header) > 1:
+                    get = itemgetter(*header)
+                else:
+                    get = lambda r: (r[header[0]],)
+                writer.writerow(header)
+            try:
+                writer.writerow(get(row))
+            except KeyError:
+                # キーが欠けている行だけ低速パスで埋める
+                writer.writerow([row.get(h, "") for h in header])
+            yield sio.getvalue().encode("utf-8")
+            sio.seek(0)
+            sio.truncate(0)
 
     filename = f"export_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv"
     return StreamingResponse(
         generate(),
-        media_type="text/csv",
+        media_type="text/csv; charset=utf-8",
         headers={"Content-Disposition": f'attachment; filename="{filename}"'},
     )
 
@@ -263,26 +404,68 @@ def download_all_csv(
 # ⑤ 特定データセット明細
 # =====================================================
 @router.get("/{dataset_id}")
-def get_dataset_details(
+async def get_dataset_details(
     dataset_id: int,
     page: int = Query(1, ge=1),
     size: int = Query(20, ge=1, le=200),
+    after_id: Optional[int] = Query(None, description="このIDより後の行を返す（キーセットページング用カーソル）"),
     filter_col: Optional[str] = Query(None),
     filter_val: Optional[str] = Query(None),
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
     user: str = Depends(basic_auth),
 ):
-    dataset = db.get(ExpenseDataset, dataset_id)
+    dataset = await db.get(ExpenseDataset, dataset_id)
     if not dataset:
         raise HTTPException(status_code=404, detail="指定されたデータセットが見つかりません。")
 
-    stmt = select(ExpenseRow).where(ExpenseRow.dataset_id == dataset_id)
-    if filter_col and filter_val:
-        stmt = stmt.where(ExpenseRow.row_data[filter_col].astext.ilike(f"%{filter_val}%"))
+    filter_col = validate_filter_col(filter_col)
+    # 値の正規化（strip・重複除去）は条件生成の中で1回だけ行う
+    filter_cond = (
+        row_filter_condition(filter_col, filter_val)
+        if filter_col and filter_val else None
+    )
+
+    # 🔖 キーセットページング：OFFSETのように先頭からの読み捨てが発生しない
+    if after_id is not None:
+        stmt = (
+            select(ExpenseRow.id, ExpenseRow.row_data)
+            .where(ExpenseRow.dataset_id == dataset_id)
+            .where(ExpenseRow.id > after_id)
+        )
+        if filter_cond is not None:
+            stmt = stmt.where(filter_cond)
+        rows = (await db.execute(stmt.order_by(ExpenseRow.id).limit(size))).all()
+        return {
+            "meta": {
+                "branch_name": dataset.branch_name,
+                "period": dataset.period,
+                "size": size,
+                "next_cursor": rows[-1][0] if rows else None,
+            },
+            "data": [r[1] for r in rows],
+        }
 
-    total = db.scalar(select(func.count()).select_from(stmt.subquery()))
     offset = (page - 1) * size
-    rows = db.execute(stmt.offset(offset).limit(size)).scalars().all()
+
+    if filter_cond is not None:
+        # フィルタ時はCOUNT(*)の往復を省き、ページングと同じクエリで件数を取る
+        stmt = (
+            select(ExpenseRow.row_data, func.count().over().label("_total"))
+            .where(ExpenseRow.dataset_id == dataset_id)
+            .where(filter_cond)
+        )
+        rows = (await db.execute(
+            stmt.order_by(ExpenseRow.id).offset(offset).limit(size)
+        )).all()
+        total = rows[0][1] if rows else 0
+        data = [r[0] for r in rows]
+    else:
+        # フィルタなしの合計はアップロード時に保存済みのrow_countで足りる
+        stmt = select(ExpenseRow.row_data).where(ExpenseRow.dataset_id == dataset_id)
+        data = (await db.execute(
+            stmt.order_by(ExpenseRow.id).offset(offset).limit(size)
+        )).scalars().all()
+        total = dataset.row_count
 
     return {
         "meta": {
@@ -292,7 +475,7 @@ def get_dataset_details(
             "page": page,
             "size": size,
         },
-        "data": [r.row_data for r in rows],
+        "data": data,
     }
 
 
@@ -300,15 +483,15 @@ def get_dataset_details(
 # ⑥ デバッグ用API
 # =====================================================
 @router.get("/_debug/dbinfo")
-def debug_info(
-    db: Session = Depends(get_db),
+async def debug_info(
+    db: AsyncSession = Depends(get_db),
     user: str = Depends(basic_auth),
 ):
-    total = db.scalar(select(func.count(ExpenseDataset.id)))
-    by_branch = db.execute(
+    total = await db.scalar(select(func.count(ExpenseDataset.id)))
+    by_branch = (await db.execute(
         select(ExpenseDataset.branch_name, func.count())
         .group_by(ExpenseDataset.branch_name)
-    ).all()
+    )).all()
     return {
         "database": "expenses",
         "datasets": total,
@@ -1,9 +1,17 @@
 # seed_test_data.py
-from app.db import SessionLocal
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
 from app.models import ExpenseDataset, ExpenseRow
 from datetime import datetime, timedelta
+from dotenv import load_dotenv
+import os
 import random
 
+# アプリ本体はasyncエンジンだが、このスクリプトは同期ドライバで十分
+load_dotenv()
+engine = create_engine(os.getenv("DATABASE_URL"))
+SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
 # === 設定 ===
 BRANCHES = ["東京支店", "大阪支店", "名古屋支店", "福岡支店"]
 ACCOUNTS = ["旅費交通費", "会議費", "交際費", "消耗品費", "通信費"]
@@ -1,39 +1,34 @@
 from fastapi import FastAPI, Depends, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.middleware.gzip import GZipMiddleware
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, ORJSONResponse
 from starlette.exceptions import HTTPException as StarletteHTTPException
 from sqlalchemy import text
 
 # 🔐 認証用
-from app.auth import basic_auth_middleware, basic_auth
+from app.auth import BasicAuthMiddleware, basic_auth
 
 # 📦 ルーター & DB
 from app.routers import expenses
-from app.db import get_db
-from app.logger import logger
-
-import logging
-
-# ==========================
-# ログ設定
-# ==========================
-logging.basicConfig(
-    level=logging.INFO,
-    format="%(asctime)s [%(levelname)s] %(message)s",
-    handlers=[
-        logging.StreamHandler(),                     # コンソール出力
-        logging.FileHandler("app.log", encoding="utf-8")  # ファイル出力
-    ]
-)
-
-logger = logging.getLogger(__name__)
+from app.db import get_db, engine
+from app.logger import logger, listener as log_listener
 
+import os
 
 # ============================
 # 🚀 FastAPI アプリ作成
 # ============================
-app = FastAPI(title="Expense Management App")
+# 本番（ENV=prod）ではSwagger / OpenAPIスキーマを公開しない
+_IS_PROD = os.getenv("ENV") == "prod"
+
+app = FastAPI(
+    title="Expense Management App",
+    default_response_class=ORJSONResponse,
+    openapi_url=None if _IS_PROD else "/openapi.json",
+    docs_url=None if _IS_PROD else "/docs",
+    redoc_url=None if _IS_PROD else "/redoc",
+)
 
 # ============================
 # 🧭 グローバル エラーハンドラー
@@ -52,10 +47,16 @@ async def unhandled_exception_handler(request: Request, exc: Exception):
         content={"error": f"Internal Server Error: {str(exc)}"},
     )
 
+# ============================
+# 🗜️ gzip圧縮（CSV/JSONのような繰り返しの多いテキストが対象）
+# ============================
+# StreamingResponseにも効き、チャンク毎に圧縮するのでメモリは増えない
+app.add_middleware(GZipMiddleware, minimum_size=1024)
+
 # ============================
 # 🔐 Basic認証ミドルウェア（全API共通）
 # ============================
-app.middleware("http")(basic_auth_middleware)
+app.add_middleware(BasicAuthMiddleware)
 
 # ============================
 # 🌐 CORS設定（開発用）
@@ -69,8 +70,8 @@ app.add_middleware(
         "file://",
     ],
     allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
+    allow_methods=["GET", "POST"],
+    allow_headers=["authorization", "content-type"],
 )
 
 # ============================
@@ -94,6 +95,16 @@ def secure_endpoint():
 # 🧰 DB接続確認用
 # ============================
 @app.get("/test-db")
-def test_db(db=Depends(get_db)):
-    version = db.execute(text("SELECT version();")).scalar()
+async def test_db(db=Depends(get_db)):
+    version = (await db.execute(text("SELECT version();"))).scalar()
     return {"postgres_version": version}
+
+# ============================
+# 🪵 shutdown時の後始末
+# ============================
+@app.on_event("shutdown")
+async def on_shutdown():
+    # コネクションプールを明示的に返却してから終了する
+    await engine.dispose()
+    # ログキューに残った分を書き切る
+    log_listener.stop()